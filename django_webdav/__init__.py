@@ -16,88 +16,314 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with django-webdav.  If not, see <http://www.gnu.org/licenses/>.
 
-import os, datetime, mimetypes, time, shutil, urllib, urlparse, httplib, re, calendar
-from xml.etree import ElementTree
+import os, io, posixpath, stat, errno, datetime, mimetypes, time, shutil, urllib, urlparse, httplib, re, \
+calendar, itertools, threading
+try:
+    from lxml import etree as ElementTree
+except ImportError:
+    try:
+        from xml.etree import cElementTree as ElementTree
+    except ImportError:
+        from xml.etree import ElementTree
+from collections import deque
+from xml.sax.saxutils import escape as xml_escape
+from multiprocessing.pool import ThreadPool
 from django.conf import settings
 from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound, \
 HttpResponseNotAllowed, HttpResponseBadRequest, HttpResponseNotModified
 from django.http import Http404 as HttpNotFound
-from django.utils import hashcompat, synch
-from django.utils.http import http_date, parse_etags
+from django.core.servers.basehttp import FileWrapper
+from django.utils import synch
+from django.utils.http import http_date, parse_etags, quote_etag
 from django.utils.encoding import smart_unicode
-from django.shortcuts import render_to_response
+from django.template import Context
+from django.template.loader import get_template
+from django_webdav import _statx
 try:
     from email.utils import parsedate_tz
 except ImportError:
     from email.Utils import parsedate_tz
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 PATTERN_IF_DELIMITER = re.compile(r'(\<([^>]+)\>)|(\(([^\)]+)\))')
+# A Range header asking for a single range of bytes, see parse_range().
+PATTERN_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Serialize the DAV: namespace with the customary D: prefix rather than ns0:.
+ElementTree.register_namespace('D', 'DAV:')
+
+# The thread pool shared by directory listings when DAV_STAT_PREFETCH_WORKERS is set, and the
+# number of entries whose stat() calls are handed to it at once, see stat_entries().
+STAT_POOL = None
+STAT_POOL_LOCK = threading.Lock()
+STAT_BATCH_SIZE = 64
 
 # Sun, 06 Nov 1994 08:49:37 GMT  ; RFC 822, updated by RFC 1123
 FORMAT_RFC_822 = '%a, %d %b %Y %H:%M:%S GMT'
 # Sunday, 06-Nov-94 08:49:37 GMT ; RFC 850, obsoleted by RFC 1036
-FORMAT_RFC_850 = '%A %d-%b-%y %H:%M:%S GMT'
+FORMAT_RFC_850 = '%A, %d-%b-%y %H:%M:%S GMT'
 # Sun Nov  6 08:49:37 1994       ; ANSI C's asctime() format
 FORMAT_ASC = '%a %b %d %H:%M:%S %Y'
+# 1994-11-06T08:49:37Z           ; RFC 3339, always in UTC
+FORMAT_RFC_3339 = '%Y-%m-%dT%H:%M:%SZ'
+
+# Values of the Depth header, -1 stands for infinity.
+DEPTH_VALUES = {'0': 0, '1': 1, 'infinity': -1}
+
+# Content types by file extension, see guess_content_type(). Filled with the known types up
+# front, so the common extensions never reach mimetypes at request time.
+mimetypes.init()
+CONTENT_TYPES = dict((ext.lower(), content_type) for ext, content_type in mimetypes.types_map.items())
+# Extensions come from the client, at most this many unknown ones are remembered.
+CONTENT_TYPES_MAX = len(CONTENT_TYPES) + 1024
+
+# Most stat results kept per request by DavServer.stat_cache.
+STAT_CACHE_SIZE = 256
+
+# The compiled directory index template, see get_index_template().
+INDEX_TEMPLATE = None
+
+# Formatted dates by whole second timestamp, see http_date_cached() and rfc3339_date().
+HTTP_DATES = {}
+RFC3339_DATES = {}
+DATE_CACHE_SIZE = 4096
+
+# Element names and status lines used to build multistatus responses. Built once rather
+# than spelled out (and allocated) again for every property of every resource.
+TAG_PROPFIND = '{DAV:}propfind'
+TAG_ALLPROP = '{DAV:}allprop'
+TAG_PROPNAME = '{DAV:}propname'
+TAG_RESPONSE = '{DAV:}response'
+TAG_HREF = '{DAV:}href'
+TAG_PROPSTAT = '{DAV:}propstat'
+TAG_STATUS = '{DAV:}status'
+TAG_PROP = '{DAV:}prop'
+TAG_COLLECTION = '{DAV:}collection'
+STATUS_200 = 'HTTP/1.1 200 OK'
+STATUS_404 = 'HTTP/1.1 404 Not Found'
+# Start and end of a serialized response element that only holds found properties, see
+# DavProperty.get_response_xml().
+RESPONSE_START = ('<D:response xmlns:D="DAV:"><D:href>%s</D:href><D:propstat><D:status>' +
+    STATUS_200 + '</D:status><D:prop>')
+RESPONSE_END = '</D:prop></D:propstat></D:response>'
+
+# Allow header values sent by OPTIONS, for collections, other resources and missing ones.
+ALLOW_COLLECTION = 'OPTIONS HEAD GET DELETE PROPFIND PROPPATCH COPY MOVE LOCK UNLOCK'
+ALLOW_RESOURCE = 'OPTIONS HEAD GET PUT DELETE PROPFIND PROPPATCH COPY MOVE LOCK UNLOCK'
+ALLOW_MISSING = 'OPTIONS PUT MKCOL'
+
+# Block size used when copying file bodies to and from the client.
+COPY_BUFSIZE = 1024 * 1024
+# Default upper bound for the PROPFIND request body that is read into memory, larger bodies
+# are refused. Can be changed with the DAV_MAX_PROPFIND_BODY setting.
+MAX_PROPFIND_BODY = 64 * 1024
+# Serialized multistatus responses are handed to the server in chunks of about this size.
+MULTISTATUS_CHUNK_SIZE = 64 * 1024
 
 def safe_join(root, *paths):
     '''The provided os.path.join() does not work as desired. Any path starting with /
-    will simply be returned rather than actually being joined with the other elements.'''
+    will simply be returned rather than actually being joined with the other elements.
+    The joined paths are normalized, so '..' components can not climb above root.'''
     if not root.startswith('/'):
         root = '/' + root
-    for path in paths:
-        while root.endswith('/'):
-            root = root[:-1]
-        while path.startswith('/'):
-            path = path[1:]
-        root += '/' + path
-    return root
+    if not paths:
+        return root
+    # Anchoring at / makes normpath() drop any '..' that would leave root.
+    joined = '/'.join(paths)
+    path = posixpath.normpath('/' + joined).lstrip('/')
+    if path and joined.endswith('/'):
+        path += '/'
+    return root.rstrip('/') + '/' + path
 
 def url_join(base, *paths):
     '''Assuming base is the scheme and host (and perhaps path) we will join the remaining
     path elements to it.'''
-    paths = safe_join(*paths)
-    while base.endswith('/'):
-        base = base[:-1]
-    return base + paths
+    return base.rstrip('/') + safe_join(*paths)
 
 def ns_split(tag):
     '''Splits the namespace and property name from a clark notation property name.'''
-    if tag.startswith("{") and "}" in tag:
-        ns, name = tag.split("}", 1)
-        return (ns[1:-1], name)
-    return ("", tag)
+    if tag[:1] == '{':
+        end = tag.find('}')
+        if end != -1:
+            return (tag[1:end], tag[end + 1:])
+    return ('', tag)
 
 def ns_join(ns, name):
     '''Joins a namespace and property name into clark notation.'''
-    return '{%s:}%s' % (ns, name)
+    return '{%s}%s' % (ns, name)
 
 def rfc3339_date(date):
-  if not date:
-      return ''
-  if not isinstance(date, datetime.date):
-      date = datetime.date.fromtimestamp(date)
-  date = date + datetime.timedelta(seconds=-time.timezone)
-  if time.daylight:
-    date += datetime.timedelta(seconds=time.altzone)
-  return date.strftime('%Y-%m-%dT%H:%M:%SZ')
-
-def parse_time(time):
-    value = None
+    '''Format a UNIX timestamp (or a naive UTC datetime) as an RFC 3339 date.'''
+    if not date:
+        return ''
+    if isinstance(date, datetime.date):
+        return date.strftime(FORMAT_RFC_3339)
+    stamp = int(date)
+    try:
+        return RFC3339_DATES[stamp]
+    except KeyError:
+        if len(RFC3339_DATES) >= DATE_CACHE_SIZE:
+            RFC3339_DATES.clear()
+        value = RFC3339_DATES[stamp] = datetime.datetime.utcfromtimestamp(stamp).strftime(FORMAT_RFC_3339)
+        return value
+
+def http_date_cached(stamp):
+    '''Like http_date(), but the result is remembered for each second. Resources in a listing
+    often share their timestamps, and formatting is the expensive part.'''
+    stamp = int(stamp)
+    try:
+        return HTTP_DATES[stamp]
+    except KeyError:
+        if len(HTTP_DATES) >= DATE_CACHE_SIZE:
+            HTTP_DATES.clear()
+        value = HTTP_DATES[stamp] = http_date(stamp)
+        return value
+
+def parse_time(timestring):
+    '''Parse an HTTP date into a UNIX timestamp, returns None if the date is not understood.'''
     for fmt in (FORMAT_RFC_822, FORMAT_RFC_850, FORMAT_ASC):
         try:
-            value = time.strptime(timestring, fmt)
-        except:
-            pass
-    if value is None:
-        try:
-            # Sun Nov  6 08:49:37 1994 +0100      ; ANSI C's asctime() format with timezone
-            value = parsedate_tz(timestring)
-        except:
+            return calendar.timegm(time.strptime(timestring, fmt))
+        except ValueError:
             pass
+    # Sun Nov  6 08:49:37 1994 +0100      ; ANSI C's asctime() format with timezone
+    value = parsedate_tz(timestring)
     if value is None:
         return
-    return calendar.timegm(result)
+    return calendar.timegm(value[:9]) - (value[9] or 0)
+
+def guess_content_type(name):
+    '''Return the content type for a file name, based on its extension. Results are kept in
+    CONTENT_TYPES, so mimetypes is consulted at most once per extension.'''
+    ext = os.path.splitext(name)[1].lower()
+    try:
+        return CONTENT_TYPES[ext]
+    except KeyError:
+        content_type = mimetypes.guess_type('file' + ext)[0] or 'application/octet-stream'
+        # Extensions come from the client, don't let the cache grow without bounds.
+        if len(CONTENT_TYPES) < CONTENT_TYPES_MAX:
+            CONTENT_TYPES[ext] = content_type
+        return content_type
+
+def get_index_template():
+    '''Return the compiled directory index template. It is looked up and parsed only once,
+    not for every directory listing.'''
+    global INDEX_TEMPLATE
+    if INDEX_TEMPLATE is None:
+        INDEX_TEMPLATE = get_template('webdav/index.html')
+    return INDEX_TEMPLATE
+
+def stat_path(path):
+    '''Like os.stat(). With DAV_USE_STATX enabled, statx() is used on Linux instead, which
+    lets network file systems answer from cached attributes.'''
+    if getattr(settings, 'DAV_USE_STATX', False) and _statx.available():
+        return _statx.statx(path)
+    return os.stat(path)
+
+def copy_tree(src, dst):
+    '''Copy the contents of the directory src into the existing directory dst, merging with
+    what is there already. Entries of the wrong type in dst are replaced. Like the rest of
+    this module, symlinks are followed.'''
+    for dirpath, dirnames, filenames in os.walk(src, followlinks=True):
+        target = os.path.normpath(os.path.join(dst, os.path.relpath(dirpath, src)))
+        for name in dirnames:
+            path = os.path.join(target, name)
+            if not os.path.isdir(path):
+                if os.path.lexists(path):
+                    os.remove(path)
+                os.mkdir(path)
+        for name in filenames:
+            path = os.path.join(target, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            shutil.copy(os.path.join(dirpath, name), path)
+
+def parse_range(value, size):
+    '''Parse a Range header for a resource of the given size. Returns (start, end), end being
+    inclusive, if a single satisfiable byte range was asked for and False if the range can
+    not be satisfied. Anything else (several ranges, malformed values) returns None, the
+    header is then ignored and the whole resource is sent.'''
+    match = PATTERN_RANGE.match(value.strip())
+    if match is None:
+        return
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return
+        # Suffix range, the last N bytes.
+        length = int(end)
+        if length == 0 or size == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if start >= size:
+        return False
+    if not end:
+        return start, size - 1
+    end = int(end)
+    if end < start:
+        return
+    return start, min(end, size - 1)
+
+def iter_file_range(f, start, length):
+    '''Yield length bytes of the open file f from offset start on, in blocks of COPY_BUFSIZE.
+    The file is closed when done.'''
+    try:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(length, COPY_BUFSIZE))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+def stat_entry(entry):
+    '''Return the stat result for a directory entry, either a scandir() DirEntry or an absolute
+    path, or None if it can not be stat()ed. With DAV_USE_STATX enabled, DirEntry objects go
+    through stat_path() as well.'''
+    try:
+        if isinstance(entry, basestring):
+            return stat_path(entry)
+        if getattr(settings, 'DAV_USE_STATX', False):
+            return stat_path(entry.path)
+        return entry.stat()
+    except OSError:
+        return
+
+def get_stat_pool(workers):
+    '''Return the thread pool used by stat_entries(). It is created with the given number of
+    threads on first use and then shared by all requests.'''
+    global STAT_POOL
+    if STAT_POOL is None:
+        with STAT_POOL_LOCK:
+            if STAT_POOL is None:
+                STAT_POOL = ThreadPool(workers)
+    return STAT_POOL
+
+def stat_entries(items, workers=0):
+    '''Yield (name, stat result) for an iterable of (name, entry) pairs, see stat_entry(). With
+    workers, the stat() calls of STAT_BATCH_SIZE entries at a time are made in a thread pool, so
+    they overlap. That pays off on file systems where each call is a network round trip (NFS,
+    FUSE).'''
+    if not workers:
+        for name, entry in items:
+            yield name, stat_entry(entry)
+        return
+    pool = get_stat_pool(workers)
+    while True:
+        batch = list(itertools.islice(items, STAT_BATCH_SIZE))
+        if not batch:
+            return
+        for (name, entry), st in zip(batch, pool.map(stat_entry, [entry for name, entry in batch])):
+            yield name, st
 
 
 # When possible, code returns an HTTPResponse sub-class. In some situations, we want to be able
@@ -113,7 +339,15 @@ class HttpError(Exception):
 
     def get_response(self):
         '''Creates an HTTPResponse for the given status code.'''
-        return HttpResponse(self.message, status_code=self.status_code)
+        return HttpResponse(self.message, status=self.status_code)
+
+
+class HttpNotModified(HttpError):
+    status_code = httplib.NOT_MODIFIED
+
+
+class HttpBadRequest(HttpError):
+    status_code = httplib.BAD_REQUEST
 
 
 class HttpCreated(HttpError):
@@ -164,6 +398,18 @@ class HttpResponsePreconditionFailed(HttpResponse):
     status_code = httplib.PRECONDITION_FAILED
 
 
+class HttpResponsePartialContent(HttpResponse):
+    status_code = httplib.PARTIAL_CONTENT
+
+
+class HttpRangeNotSatisfiable(HttpError):
+    status_code = httplib.REQUESTED_RANGE_NOT_SATISFIABLE
+
+
+class HttpResponseRangeNotSatisfiable(HttpResponse):
+    status_code = httplib.REQUESTED_RANGE_NOT_SATISFIABLE
+
+
 class HttpMediatypeNotSupported(HttpError):
     status_code = httplib.UNSUPPORTED_MEDIA_TYPE
 
@@ -172,6 +418,14 @@ class HttpResponseMediatypeNotSupported(HttpResponse):
     status_code = httplib.UNSUPPORTED_MEDIA_TYPE
 
 
+class HttpRequestEntityTooLarge(HttpError):
+    status_code = httplib.REQUEST_ENTITY_TOO_LARGE
+
+
+class HttpResponseRequestEntityTooLarge(HttpResponse):
+    status_code = httplib.REQUEST_ENTITY_TOO_LARGE
+
+
 class HttpNotImplemented(HttpError):
     status_code = httplib.NOT_IMPLEMENTED
 
@@ -187,6 +441,8 @@ class HttpResponseBadGateway(HttpResponse):
 class DavAcl(object):
     '''Represents all the permissions that a user might have on a resource. This
     makes it easy to implement virtual permissions.'''
+    __slots__ = ('read', 'write', 'delete', 'create', 'relocate', 'list')
+
     def __init__(self, read=True, write=True, delete=True, create=True, relocate=True, list=True, all=None):
         if not all is None:
             self.read = self.write = self.delete = \
@@ -199,17 +455,56 @@ class DavAcl(object):
         self.list = list
 
 
+class DavNegativeCache(object):
+    '''Remembers absolute paths that were recently found missing. Clients tend to probe the
+    same nonexistent files (desktop.ini, .DS_Store, ._* forks) over and over, this allows
+    answering those probes without a stat() call. Entries expire after DAV_NEGATIVE_CACHE_TTL
+    seconds, the default of 0 disables the cache. Keep the TTL short, changes made outside of
+    this server (or by another process) are only noticed once an entry expires.'''
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = {}
+
+    def get_ttl(self):
+        return getattr(settings, 'DAV_NEGATIVE_CACHE_TTL', 0)
+
+    def __contains__(self, path):
+        expires = self.entries.get(path)
+        if expires is None:
+            return False
+        if expires < time.time():
+            self.entries.pop(path, None)
+            return False
+        return True
+
+    def add(self, path):
+        ttl = self.get_ttl()
+        if not ttl:
+            return
+        if len(self.entries) >= self.maxsize:
+            self.entries.clear()
+        self.entries[path] = time.time() + ttl
+
+    def clear(self):
+        self.entries.clear()
+
+
 class DavResource(object):
     '''Implements an interface to the file system. This can be subclassed to provide
     a virtual file system (like say in MySQL). This default implementation simply uses
     python's os library to do most of the work.'''
+    # A PROPFIND creates one instance per descendant, keep them small.
+    __slots__ = ('server', 'root', 'path', '_stat', '_abs_path', '_name', '_url', '_parent')
+
     def __init__(self, server, path):
         self.server = server
         self.root = server.get_root()
         # Trailing / messes with dirname and basename.
-        while path.endswith('/'):
-            path = path[:-1]
-        self.path = path
+        self.path = path.rstrip('/')
+        # Cached os.stat() result, None until fetched, False if the resource is missing.
+        self._stat = None
+        # The following only depend on the path and are computed on first use.
+        self._abs_path = self._name = self._url = self._parent = None
 
     def get_path(self):
         '''Return the path of the resource relative to the root.'''
@@ -219,36 +514,77 @@ class DavResource(object):
         '''Return the absolute path of the resource. Used internally to interface with
         an actual file system. If you override all other methods, this one will not
         be used.'''
-        return safe_join(self.root, self.path)
+        if self._abs_path is None:
+            self._abs_path = safe_join(self.root, self.path)
+        return self._abs_path
+
+    def get_stat(self):
+        '''Return the os.stat() result for this resource, or None if it does not exist. The
+        result is cached, so the metadata methods below share a single stat() call. It is also
+        kept in the server's per request stat_cache, so other resource objects for the same
+        path (parents, COPY/MOVE destinations) reuse it. Methods that modify the resource reset
+        the cache.'''
+        if self._stat is None:
+            abs_path = self.get_abs_path()
+            stat_cache = self.server.stat_cache
+            try:
+                self._stat = stat_cache[abs_path]
+            except KeyError:
+                if abs_path in self.server.negative_cache:
+                    self._stat = False
+                else:
+                    try:
+                        self._stat = stat_path(abs_path)
+                    except OSError:
+                        self._stat = False
+                        self.server.negative_cache.add(abs_path)
+                # Listings bring their own stat results, this only needs to hold a few paths.
+                if len(stat_cache) < STAT_CACHE_SIZE:
+                    stat_cache[abs_path] = self._stat
+        return self._stat or None
+
+    def _reset_stat(self):
+        '''Forget the cached stat result. Called whenever this resource is modified.'''
+        self._stat = None
+        # A change may affect paths below this one too (say a renamed directory, rmtree() or
+        # copy_tree()), and changes are rare compared to lookups, so start over.
+        self.server.negative_cache.clear()
+        self.server.stat_cache.clear()
 
     def isdir(self):
         '''Return True if this resource is a directory (collection in WebDAV parlance).'''
-        return os.path.isdir(self.get_abs_path())
+        st = self.get_stat()
+        return st is not None and stat.S_ISDIR(st.st_mode)
 
     def isfile(self):
         '''Return True if this resource is a file (resource in WebDAV parlance).'''
-        return os.path.isfile(self.get_abs_path())
+        st = self.get_stat()
+        return st is not None and stat.S_ISREG(st.st_mode)
 
     def exists(self):
         '''Return True if this resource exists.'''
-        return os.path.exists(self.get_abs_path())
+        return self.get_stat() is not None
 
     def get_name(self):
         '''Return the name of the resource (without path information).'''
         # No need to use absolute path here
-        return os.path.basename(self.path)
+        if self._name is None:
+            self._name = self.path.rpartition('/')[2]
+        return self._name
 
     def get_dirname(self):
         '''Return the resource's parent directory's absolute path.'''
-        return os.path.dirname(self.get_abs_path())
+        head, sep, tail = self.get_abs_path().rpartition('/')
+        head += sep
+        return head.rstrip('/') or head
 
     def get_size(self):
         '''Return the size of the resource in bytes.'''
-        return os.path.getsize(self.get_abs_path())
+        return self.get_stat().st_size
 
     def get_ctime_stamp(self):
         '''Return the create time as UNIX timestamp.'''
-        return os.stat(self.get_abs_path()).st_ctime
+        return self.get_stat().st_ctime
 
     def get_ctime(self):
         '''Return the create time as datetime object.'''
@@ -256,7 +592,7 @@ class DavResource(object):
 
     def get_mtime_stamp(self):
         '''Return the modified time as UNIX timestamp.'''
-        return os.stat(self.get_abs_path()).st_mtime
+        return self.get_stat().st_mtime
 
     def get_mtime(self):
         '''Return the modified time as datetime object.'''
@@ -265,47 +601,121 @@ class DavResource(object):
     def get_url(self):
         '''Return the url of the resource. This uses the request base url, so it
         is likely to work even for an overridden DavResource class.'''
-        return url_join(self.server.request.get_base_url(), self.path)
+        if self._url is None:
+            self._url = url_join(self.server.request.get_base_url(), self.path)
+        return self._url
 
     def get_parent(self):
         '''Return a DavResource for this resource's parent.'''
-        return self.__class__(self.server, os.path.dirname(self.path))
+        if self._parent is None:
+            # One rpartition() yields both the parent path and the name, the same values
+            # posixpath.dirname() and basename() would return.
+            head, sep, name = self.path.rpartition('/')
+            head += sep
+            if self._name is None:
+                self._name = name
+            self._parent = self.__class__(self.server, head.rstrip('/') or head)
+        return self._parent
+
+    def get_child(self, name):
+        '''Return a DavResource for the direct child with the given name. The child's name and
+        absolute path are derived from this resource instead of being computed again.'''
+        child = self.__class__(self.server, self.path + '/' + name)
+        child._name = name
+        child._abs_path = self.get_abs_path().rstrip('/') + '/' + name
+        return child
 
     # TODO: combine this and get_children()
     def get_descendants(self, depth=1, include_self=True):
-        '''Return an iterator of all descendants of this resource.'''
+        '''Return an iterator of all descendants of this resource, breadth first. Directories
+        are listed lazily, the queue holds the pending listings (iterators), not their entries.'''
         if include_self:
             yield self
-        # If depth is less than 0, then it started out as -1.
-        # We need to keep recursing until we hit 0, or forever
-        # in case of infinity.
-        if depth != 0:
-            for child in self.get_children():
-                for desc in child.get_descendants(depth=depth-1, include_self=True):
-                    yield desc
+        if depth == 0 or not self.isdir():
+            return
+        queue = deque([(self.get_children(), depth - 1)])
+        children = None
+        try:
+            while queue:
+                children, depth = queue.popleft()
+                while True:
+                    try:
+                        child = next(children)
+                    except StopIteration:
+                        break
+                    except OSError:
+                        # The directory can not be listed (permissions, removed meanwhile). Once
+                        # a multistatus response is under way there is no way to report an
+                        # error, so the rest of it is skipped.
+                        break
+                    yield child
+                    # If depth is less than 0, then it started out as -1.
+                    # We need to keep descending until we hit 0, or forever
+                    # in case of infinity.
+                    if depth != 0 and child.isdir():
+                        queue.append((child.get_children(), depth - 1))
+        finally:
+            # When the walk is abandoned (the client went away), close the listing in progress
+            # so its directory handle is released now. Queued listings have not started yet.
+            if children is not None:
+                children.close()
 
     # TODO: combine this and get_descendants()
     def get_children(self):
-        '''Return an iterator of all direct children of this resource.'''
-        for child in os.listdir(self.get_abs_path()):
-            yield self.__class__(self.server, os.path.join(self.get_path(), child))
+        '''Return an iterator of all direct children of this resource. Every child comes with its
+        stat result, from scandir() where available. Entries that can not be stat()ed (broken
+        symlinks, entries removed in the meantime) are left out. Set DAV_STAT_PREFETCH_WORKERS
+        to have the stat() calls made by a pool of that many threads.'''
+        abs_path = self.get_abs_path()
+        if scandir is None:
+            prefix = abs_path.rstrip('/') + '/'
+            entries = None
+            items = ((name, prefix + name) for name in os.listdir(abs_path))
+        else:
+            entries = scandir(abs_path)
+            items = ((entry.name, entry) for entry in entries)
+        try:
+            workers = getattr(settings, 'DAV_STAT_PREFETCH_WORKERS', 0)
+            for name, st in stat_entries(items, workers):
+                if st is None:
+                    continue
+                child = self.get_child(name)
+                child._stat = st
+                yield child
+        finally:
+            # Release the directory handle right away, even when the walk is abandoned (say
+            # the client went away mid PROPFIND). Older scandir backports can not be closed.
+            close = getattr(entries, 'close', None)
+            if close is not None:
+                close()
 
     def open(self, mode):
-        '''Open the resource, mode is the same as the Python file() object.'''
-        return file(self.get_abs_path(), mode)
+        '''Open the resource, mode is the same as the Python file() object. Resources are
+        always opened in binary mode, with a buffer large enough to keep the number of
+        read()/write() calls low.'''
+        if 'r' not in mode:
+            self._reset_stat()
+        if 'b' not in mode:
+            mode += 'b'
+        return io.open(self.get_abs_path(), mode, buffering=COPY_BUFSIZE)
 
     def delete(self):
         '''Delete the resource, recursive is implied.'''
-        if self.isdir():
-            for child in self.get_children():
-                child.delete()
-            os.rmdir(self.get_abs_path())
-        elif self.isfile():
-            os.remove(self.get_abs_path())
+        abs_path = self.get_abs_path()
+        if self.isdir() and not os.path.islink(abs_path):
+            shutil.rmtree(abs_path)
+        elif self.exists():
+            # Files, and symlinks (which are removed, not followed).
+            os.remove(abs_path)
+        self._reset_stat()
+        # Known to be gone now, so the exists()/isdir() checks that usually follow (COPY and
+        # MOVE onto an existing destination) need no stat() call.
+        self._stat = False
 
     def mkdir(self):
         '''Create a directory in the location of this resource.'''
         os.mkdir(self.get_abs_path())
+        self._reset_stat()
 
     def copy(self, destination, depth=0):
         '''Called to copy a resource to a new location. Overwrite is assumed, the DAV server
@@ -317,16 +727,23 @@ class DavResource(object):
                 destination.delete()
             if not destination.isdir():
                 destination.mkdir()
+            if depth == -1:
+                # Infinity, copy the whole tree in one walk rather than through a resource
+                # object per entry.
+                copy_tree(self.get_abs_path(), destination.get_abs_path())
+                # Paths below the destination were created behind the resources' backs.
+                destination._reset_stat()
             # If depth is less than 0, then it started out as -1.
             # We need to keep recursing until we hit 0, or forever
             # in case of infinity.
-            if depth != 0:
+            elif depth != 0:
                 for child in self.get_children():
-                    child.copy(self.__class__(self.server, safe_join(destination.get_path(), child.get_name())), depth=depth-1)
+                    child.copy(destination.get_child(child.get_name()), depth=depth-1)
         else:
             if destination.isdir():
                 destination.delete()
             shutil.copy(self.get_abs_path(), destination.get_abs_path())
+            destination._reset_stat()
 
     def move(self, destination):
         '''Called to move a resource to a new location. Overwrite is assumed, the DAV server
@@ -334,49 +751,76 @@ class DavResource(object):
         handle a pre-existing destination of any type.'''
         if destination.exists():
             destination.delete()
-        if self.isdir():
-            destination.mkdir()
-            for child in self.get_children():
-                child.move(self.__class__(self.server, safe_join(destination.get_path(), child.get_name())))
-            self.delete()
-        else:
+        try:
+            # A single rename() moves a whole tree, as long as it stays on the same file system.
             os.rename(self.get_abs_path(), destination.get_abs_path())
+        except OSError, e:
+            if e.errno != errno.EXDEV:
+                raise
+            if self.isdir():
+                destination.mkdir()
+                for child in self.get_children():
+                    child.move(destination.get_child(child.get_name()))
+                self.delete()
+            else:
+                shutil.copy2(self.get_abs_path(), destination.get_abs_path())
+                os.remove(self.get_abs_path())
+        self._reset_stat()
+        destination._reset_stat()
 
     def get_etag(self):
-        '''Calculate an etag for this resource. The default implementation uses an md5 sub of the
-        absolute path modified time and size. Can be overridden if resources are not stored in a
-        file system. The etag is used to detect changes to a resource between HTTP calls. So this
-        needs to change if a resource is modified.'''
-        hash = hashcompat.md5_constructor()
-        hash.update(self.get_abs_path().encode('utf-8'))
-        hash.update(str(self.get_mtime_stamp()))
-        hash.update(str(self.get_size()))
-        return hash.hexdigest()
+        '''Calculate an etag for this resource. The default implementation combines the inode,
+        size and modified time (in microseconds) from the cached stat result, like Apache does.
+        Can be overridden if resources are not stored in a file system. The etag is used to
+        detect changes to a resource between HTTP calls. So this needs to change if a resource
+        is modified. The value is returned unquoted, None if the resource does not exist.'''
+        st = self.get_stat()
+        if st is None:
+            return
+        return '%x-%x-%x' % (st.st_ino, st.st_size, int(st.st_mtime * 1000000))
 
 
 class DavRequest(object):
     '''Wraps a Django request object, and extends it with some WebDAV
     specific methods.'''
+    __slots__ = ('server', 'request', 'path', '_content_length', '_base_url')
+
     def __init__(self, server, request, path):
         self.server = server
         self.request = request
         self.path = path
+        self._content_length = None
+        self._base_url = None
 
     def __getattr__(self, name):
         return getattr(self.request, name)
 
+    def get_content_length(self):
+        '''Return the length of the request body as an integer, 0 if the client did not
+        send one (or sent garbage).'''
+        if self._content_length is None:
+            try:
+                self._content_length = int(self.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                self._content_length = 0
+        return self._content_length
+
     def get_base(self):
         '''Assuming the view is configured via urls.py to pass the path portion using
         a regular expression, we can subtract the provided path from the full request
         path to determine our base. This base is what we can make all absolute URLs
         from.'''
-        return self.META['PATH_INFO'][:-len(self.path)]
+        path_info = self.META['PATH_INFO']
+        return path_info[:len(path_info) - len(self.path)]
 
     def get_base_url(self):
         '''Build a base URL for our request. Uses the base path provided by get_base()
         and the scheme/host etc. in the request to build a URL that can be used to
-        build absolute URLs for WebDAV resources.'''
-        return self.build_absolute_uri(self.get_base())
+        build absolute URLs for WebDAV resources. The URL is built once per request, every
+        resource's get_url() is based on it.'''
+        if self._base_url is None:
+            self._base_url = self.build_absolute_uri(self.get_base())
+        return self._base_url
 
 
 class DavProperty(object):
@@ -384,6 +828,20 @@ class DavProperty(object):
         '{DAV:}getetag', '{DAV:}getcontentlength', '{DAV:}creationdate',
         '{DAV:}getlastmodified', '{DAV:}resourcetype', '{DAV:}displayname'
     ]
+    # Prebuilt start and end tags of the live properties, see get_response_xml().
+    LIVE_TAGS = dict((name, ('<D:%s>' % name[6:], '</D:%s>' % name[6:])) for name in LIVE_PROPERTIES)
+    # Value getters of the live properties, keyed by their clark notation names so no
+    # splitting is needed to find them. Every getter reads from the resource's cached stat
+    # result.
+    LIVE_GETTERS = {
+        '{DAV:}getetag': lambda res: quote_etag(res.get_etag()),
+        '{DAV:}getcontentlength': lambda res: str(res.get_size()),
+        '{DAV:}creationdate': lambda res: rfc3339_date(res.get_ctime_stamp()),  # RFC3339:
+        '{DAV:}getlastmodified': lambda res: http_date_cached(res.get_mtime_stamp()),  # RFC1123:
+        '{DAV:}resourcetype': lambda res: [] if res.isdir() else '',
+        '{DAV:}displayname': lambda res: res.get_name(),
+        '{DAV:}href': lambda res: res.get_url(),
+    }
 
     def __init__(self, server):
         self.server = server
@@ -408,31 +866,19 @@ class DavProperty(object):
         return self.LIVE_PROPERTIES + self.get_dead_names(res)
 
     def get_prop_value(self, res, name):
+        # Live properties come from the resource itself, they need no locking.
+        getter = self.LIVE_GETTERS.get(name)
+        if getter is not None:
+            # A resource that is gone (or never existed) has no live properties.
+            if not res.exists():
+                return
+            return getter(res)
+        ns, bare_name = ns_split(name)
+        if ns == 'DAV:':
+            return
         self.lock.reader_enters()
         try:
-            ns, bare_name = ns_split(name)
-            if ns != 'DAV':
-                return self.get_dead_value(res, name)
-            else:
-                value = None
-                if bare_name == 'getetag':
-                    value = res.get_etag()
-                elif bare_name == 'getcontentlength':
-                    value = str(res.get_size())
-                elif bare_name == 'creationdate':
-                    value = rfc3339_date(res.get_ctime_stamp())     # RFC3339:
-                elif bare_name == 'getlastmodified':
-                    value = http_date(res.get_mtime_stamp())        # RFC1123:
-                elif bare_name == 'resourcetype':
-                    if res.isdir():
-                        value = []
-                    else:
-                        value = ''
-                elif bare_name == 'displayname':
-                    value = res.get_name()
-                elif bare_name == 'href':
-                    value = res.get_url()
-            return value
+            return self.get_dead_value(res, name)
         finally:
             self.lock.reader_leaves()
 
@@ -440,14 +886,14 @@ class DavProperty(object):
         self.lock.writer_enters()
         try:
             ns, bare_name = ns_split(name)
-            if ns == 'DAV':
+            if ns == 'DAV:':
                 pass # TODO: handle set-able "live" properties?
             else:
                 self.set_dead_value(res, name, value)
         finally:
             self.lock.writer_leaves()
 
-    def del_props(self, res, *name):
+    def del_props(self, res, *names):
         self.lock.writer_enters()
         try:
             avail_names = self.get_prop_names(res)
@@ -455,7 +901,7 @@ class DavProperty(object):
                 names = avail_names
             for name in names:
                 ns, bare_name = ns_split(name)
-                if ns == 'DAV':
+                if ns == 'DAV:':
                     pass # TODO: handle delete-able "live" properties?
                 else:
                     self.del_dead_prop(res, name)
@@ -466,42 +912,78 @@ class DavProperty(object):
         move = kwargs.get('move', False)
         self.lock.writer_enters()
         try:
-            names = self.get_prop_names(src)
+            if not names:
+                names = self.get_prop_names(src)
             for name in names:
                 ns, bare_name = ns_split(name)
-                if ns == 'DAV':
+                if ns == 'DAV:':
                     continue
-                self.set_dead_value(dst, name, self.get_prop_value(src, name))
+                # The writer lock is held already, get_prop_value() would wait for it.
+                self.set_dead_value(dst, name, self.get_dead_value(src, name))
                 if move:
-                    self.del_dead_prop(self, name)
+                    self.del_dead_prop(src, name)
         finally:
             self.lock.writer_leaves()
 
     def get_propstat(self, res, el, *names):
         '''Returns the XML representation of a resource's properties. Thread synchronization is handled
         in the get_prop_value() method individually for each property.'''
+        # Bound once, the loop below creates several elements per property.
+        SubElement = ElementTree.SubElement
         el404, el200 = None, None
         avail_names = self.get_prop_names(res)
         if not names:
             names = avail_names
+        else:
+            # Requested names are checked against a set, not searched for in the list.
+            avail_names = frozenset(avail_names)
         for name in names:
             if name in avail_names:
                 value = self.get_prop_value(res, name)
                 if el200 is None:
-                    el200 = ElementTree.SubElement(el, '{DAV:}propstat')
-                    ElementTree.SubElement(el200, '{DAV:}status').text = 'HTTP/1.1 200 OK'
-                prop = ElementTree.SubElement(el200, '{DAV:}prop')
-                prop = ElementTree.SubElement(prop, name)
+                    el200 = SubElement(el, TAG_PROPSTAT)
+                    SubElement(el200, TAG_STATUS).text = STATUS_200
+                    prop200 = SubElement(el200, TAG_PROP)
+                prop = SubElement(prop200, name)
                 if isinstance(value, list):
-                    prop.append(ElementTree.Element("{DAV:}collection"))
+                    prop.append(ElementTree.Element(TAG_COLLECTION))
                 elif value:
                     prop.text = smart_unicode(value)
             else:
                 if el404 is None:
-                    el404 = ElementTree.SubElement(el, '{DAV:}propstat')
-                    ElementTree.SubElement(el404, '{DAV:}status').text = 'HTTP/1.1 404 Not Found'
-                prop = ElementTree.SubElement(el404, '{DAV:}prop')
-                prop = ElementTree.SubElement(prop, name)
+                    el404 = SubElement(el, TAG_PROPSTAT)
+                    SubElement(el404, TAG_STATUS).text = STATUS_404
+                    prop404 = SubElement(el404, TAG_PROP)
+                SubElement(prop404, name)
+
+    def get_response_xml(self, res, *names):
+        '''Return the serialized response element of a resource for a multistatus document. When
+        all requested properties are live ones (as in the usual allprop PROPFIND) the XML is
+        assembled from prebuilt tags, otherwise an element tree is built and serialized.'''
+        avail_names = self.get_prop_names(res)
+        if not names:
+            names = avail_names
+        else:
+            # Requested names are checked against a set, not searched for in the list.
+            avail_names = frozenset(avail_names)
+        if all(name in self.LIVE_TAGS and name in avail_names for name in names):
+            parts = [RESPONSE_START % xml_escape(smart_unicode(res.get_url())).encode('utf-8')]
+            for name in names:
+                start, end = self.LIVE_TAGS[name]
+                value = self.get_prop_value(res, name)
+                if isinstance(value, list):
+                    value = '<D:collection />'
+                elif value:
+                    value = xml_escape(smart_unicode(value)).encode('utf-8')
+                else:
+                    value = ''
+                parts.append(start + value + end)
+            parts.append(RESPONSE_END)
+            return ''.join(parts)
+        response = ElementTree.Element(TAG_RESPONSE)
+        ElementTree.SubElement(response, TAG_HREF).text = smart_unicode(res.get_url())
+        self.get_propstat(res, response, *names)
+        return ElementTree.tostring(response, encoding='utf-8')
 
 
 class DavLock(object):
@@ -543,12 +1025,18 @@ class DavLock(object):
 
 
 class DavServer(object):
+    # Shared by all requests, see DavNegativeCache.
+    negative_cache = DavNegativeCache()
+
     def __init__(self, request, path, property_class=DavProperty, resource_class=DavResource, lock_class=DavLock, acl_class=DavAcl):
         self.request = DavRequest(self, request, path)
         self.resource_class = resource_class
         self.acl_class = acl_class
         self.props = property_class(self)
         self.locks = lock_class(self)
+        # Stat results by absolute path for this request, shared by all resource objects that
+        # refer to the same path (see DavResource.get_stat()).
+        self.stat_cache = {}
 
     def get_root(self):
         '''Return the root of the file system we wish to export. By default the root
@@ -566,39 +1054,38 @@ class DavServer(object):
         '''Return a DavResource object to represent the given path.'''
         return self.resource_class(self, path)
 
-    def get_depth(self, default=-1):
+    def get_depth(self, default='infinity'):
+        '''Return the Depth header as an integer, -1 meaning infinity.'''
         depth = self.request.META.get('HTTP_DEPTH', default).lower()
-        if not depth in ('0', '1', 'infinity'):
+        try:
+            return DEPTH_VALUES[depth]
+        except KeyError:
             raise HttpBadRequest('Invalid depth header value %s' % depth)
-        if depth == 'infinity':
-            depth = -1
-        else:
-            depth = int(depth)
-        return depth
 
     def evaluate_conditions(self, res):
+        '''Evaluate the conditional request headers against the resource. Raises HttpNotModified
+        or HttpPreconditionFailed. The etag is only computed if an etag condition was sent.'''
         if not res.exists():
             return
-        etag = res.get_etag()
-        mtime = res.get_mtime_stamp()
+        mtime = int(res.get_mtime_stamp())
         cond_if_match = self.request.META.get('HTTP_IF_MATCH', None)
         if cond_if_match:
             etags = parse_etags(cond_if_match)
-            if '*' in etags or etag in etags:
+            if '*' not in etags and res.get_etag() not in etags:
                 raise HttpPreconditionFailed()
         cond_if_modified_since = self.request.META.get('HTTP_IF_MODIFIED_SINCE', False)
         if cond_if_modified_since:
             # Parse and evaluate, but don't raise anything just yet...
             # This might be ignored based on If-None-Match evaluation.
             cond_if_modified_since = parse_time(cond_if_modified_since)
-            if cond_if_modified_since and cond_if_modified_since > mtime:
+            if cond_if_modified_since and mtime <= cond_if_modified_since:
                 cond_if_modified_since = True
             else:
                 cond_if_modified_since = False
         cond_if_none_match = self.request.META.get('HTTP_IF_NONE_MATCH', None)
         if cond_if_none_match:
             etags = parse_etags(cond_if_none_match)
-            if '*' in etags or etag in etags:
+            if '*' in etags or res.get_etag() in etags:
                 if self.request.method in ('GET', 'HEAD'):
                     raise HttpNotModified()
                 raise HttpPreconditionFailed()
@@ -607,9 +1094,9 @@ class DavServer(object):
         cond_if_unmodified_since = self.request.META.get('HTTP_IF_UNMODIFIED_SINCE', None)
         if cond_if_unmodified_since:
             cond_if_unmodified_since = parse_time(cond_if_unmodified_since)
-            if cond_if_unmodified_since and cond_if_unmodified_since <= mtime:
+            if cond_if_unmodified_since and mtime > cond_if_unmodified_since:
                 raise HttpPreconditionFailed()
-        if cond_if_modified_since:
+        if cond_if_modified_since and self.request.method in ('GET', 'HEAD'):
             # This previously evaluated True and is not being ignored...
             raise HttpNotModified()
         # TODO: complete If header handling...
@@ -620,12 +1107,26 @@ class DavServer(object):
             #for (tmpurl, url, tmpcontent, content) in PATTERN_IF_DELIMITER.findall(cond_if):
                 
 
+    @classmethod
+    def get_methods(cls):
+        '''Return the handler method names by request method, taken from the do* methods of the
+        class (doGET handles GET). Built once per class, so a handler added in a subclass (say
+        doREPORT) is dispatched like the built in ones.'''
+        methods = cls.__dict__.get('_methods')
+        if methods is None:
+            methods = dict((name[2:], name) for name in dir(cls)
+                           if name.startswith('do') and name[2:].isupper() and callable(getattr(cls, name)))
+            cls._methods = methods
+        return methods
+
     def get_response(self):
-        handler = getattr(self, 'do' + self.request.method, None)
+        handler = self.get_methods().get(self.request.method)
         try:
-            if not callable(handler):
-                raise HttpNotAllowed()
-            return handler()
+            if handler is None:
+                response = HttpResponseNotAllowed()
+                response['Allow'] = ', '.join(sorted(self.get_methods()))
+                return response
+            return getattr(self, handler)()
         except HttpError, e:
             return e.get_response()
         except Exception, e:
@@ -633,20 +1134,30 @@ class DavServer(object):
 
     def doGET(self, head=False):
         res = self.get_resource(self.request.path)
+        if not res.exists():
+            return HttpResponseNotFound()
         acl = self.get_access(res.get_abs_path())
         if not head and res.isdir():
             if not acl.list:
                 return HttpResponseForbidden()
-            return render_to_response('webdav/index.html', { 'res': res })
+            return HttpResponse(get_index_template().render(Context({ 'res': res })))
         else:
             if not acl.read:
                 return HttpResponseForbidden()
-            if head and res.exists():
+            # Answer conditional requests before opening (or offloading) the file. The 304 still
+            # carries the validators, so clients can keep their cached copy up to date.
+            try:
+                self.evaluate_conditions(res)
+            except HttpNotModified:
+                response = HttpResponseNotModified()
+                response['ETag'] = quote_etag(res.get_etag())
+                response['Last-Modified'] = http_date_cached(res.get_mtime_stamp())
+                response['Date'] = http_date()
+                return response
+            if head:
                 response = HttpResponse()
-            elif head:
-                response = HttpResponseNotFound()
             else:
-                use_sendfile = getattr(settings, 'DAV_USE_SENDFILE', '').split()
+                use_sendfile = (getattr(settings, 'DAV_USE_SENDFILE', '') or '').split()
                 if len(use_sendfile) > 0 and use_sendfile[0].lower() == 'x-sendfile':
                     full_path = res.get_abs_path().encode('utf-8')
                     if len(use_sendfile) == 2 and use_sendfile[1] == 'escape':
@@ -660,13 +1171,32 @@ class DavServer(object):
                     response['X-Accel-Redirect'] = full_path
                     response['X-Accel-Charset'] = 'utf-8'
                 else:
-                    # Do things the slow way:
-                    response =  HttpResponse(res.open('r'))
-            if res.exists():
-                response['Content-Type'] = mimetypes.guess_type(res.get_name())
+                    size = res.get_size()
+                    byte_range = None
+                    if 'HTTP_RANGE' in self.request.META:
+                        # If-Range makes the range conditional on the resource being unchanged.
+                        if_range = self.request.META.get('HTTP_IF_RANGE')
+                        if if_range is None or if_range in (quote_etag(res.get_etag()),
+                                http_date_cached(res.get_mtime_stamp())):
+                            byte_range = parse_range(self.request.META['HTTP_RANGE'], size)
+                    if byte_range is False:
+                        response = HttpResponseRangeNotSatisfiable()
+                        response['Content-Range'] = 'bytes */%d' % size
+                        return response
+                    elif byte_range:
+                        start, end = byte_range
+                        response = HttpResponsePartialContent(iter_file_range(res.open('rb'), start, end - start + 1))
+                        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+                        response['Content-Length'] = end - start + 1
+                    else:
+                        # Do things the slow way, in large blocks rather than line by line:
+                        response = HttpResponse(FileWrapper(res.open('rb'), COPY_BUFSIZE))
+            response['Content-Type'] = guess_content_type(res.get_name())
+            if not response.has_header('Content-Length'):
                 response['Content-Length'] = res.get_size()
-                response['Last-Modified'] = http_date(res.get_mtime_stamp())
-                response['ETag'] = res.get_etag()
+            response['Accept-Ranges'] = 'bytes'
+            response['Last-Modified'] = http_date_cached(res.get_mtime_stamp())
+            response['ETag'] = quote_etag(res.get_etag())
             response['Date'] = http_date()
         return response
 
@@ -686,8 +1216,8 @@ class DavServer(object):
         if not acl.write:
             return HttpResponseForbidden()
         created = not res.exists()
-        with res.open('w') as f:
-            shutil.copyfileobj(self.request, f)
+        with res.open('wb') as f:
+            shutil.copyfileobj(self.request, f, COPY_BUFSIZE)
         if created:
             return HttpResponseCreated()
         else:
@@ -713,8 +1243,7 @@ class DavServer(object):
             return HttpResponseNotAllowed()
         if not res.get_parent().exists():
             return HttpResponseConflict()
-        length = self.request.META.get('CONTENT_LENGTH', 0)
-        if length and int(length) != 0:
+        if self.request.get_content_length():
             return HttpResponseMediatypeNotSupported()
         acl = self.get_access(res.get_abs_path())
         if not acl.create:
@@ -725,20 +1254,19 @@ class DavServer(object):
     def doCOPY(self, move=False):
         res = self.get_resource(self.request.path)
         if not res.exists():
-            return HtpResponseNotFound()
+            return HttpResponseNotFound()
         acl = self.get_access(res.get_abs_path())
         if not acl.relocate:
             return HttpResponseForbidden()
-        dst = urllib.unquote(self.request.META.get('HTTP_DESTINATION', ''))
+        dst = self.request.META.get('HTTP_DESTINATION', '')
         if not dst:
             return HttpResponseBadRequest('Destination header missing.')
-        dparts = urlparse.urlparse(dst)
-        # TODO: ensure host and scheme portion matches ours...
-        sparts = urlparse.urlparse(self.request.build_absolute_uri())
+        dparts = urlparse.urlsplit(dst)
+        sparts = urlparse.urlsplit(self.request.get_base_url())
         if sparts.scheme != dparts.scheme or sparts.netloc != dparts.netloc:
             return HttpResponseBadGateway('Source and destination must have the same scheme and host.')
         # adjust path for our base url:
-        dst = self.get_resource(dparts.path[len(self.request.get_base()):])
+        dst = self.get_resource(urllib.unquote(dparts.path)[len(self.request.get_base()):])
         if not dst.get_parent().exists():
             return HttpResponseConflict()
         overwrite = self.request.META.get('HTTP_OVERWRITE', 'T')
@@ -761,7 +1289,7 @@ class DavServer(object):
             errors = res.move(dst)
         else:
             errors = res.copy(dst, depth=depth)
-        self.props.copy(res, dst, move=move)
+        self.props.copy_props(res, dst, move=move)
         if move:
             self.locks.del_locks(res)
         if errors:
@@ -785,7 +1313,8 @@ class DavServer(object):
         response = HttpResponse(mimetype='text/html')
         response['DAV'] = '1,2'
         response['Date'] = http_date()
-        if self.request.path in ('/', '*'):
+        # The root (however the URL pattern captures it) and the server itself need no stat().
+        if self.request.path in ('', '/', '*'):
             return response
         res = self.get_resource(self.request.path)
         acl = self.get_access(res.get_abs_path())
@@ -793,12 +1322,12 @@ class DavServer(object):
             res = res.get_parent()
             if not res.isdir():
                 return HttpResponseNotFound()
-            response['Allow'] = 'OPTIONS PUT MKCOL'
+            response['Allow'] = ALLOW_MISSING
         elif res.isdir():
-            response['Allow'] = 'OPTIONS HEAD GET DELETE PROPFIND PROPPATCH COPY MOVE LOCK UNLOCK'
+            response['Allow'] = ALLOW_COLLECTION
         else:
-            response['Allow'] = 'OPTIONS HEAD GET PUT DELETE PROPFIND PROPPATCH COPY MOVE LOCK UNLOCK'
-            response['Allow-Ranges'] = 'bytes'
+            response['Allow'] = ALLOW_RESOURCE
+            response['Accept-Ranges'] = 'bytes'
         return response
 
     def doPROPFIND(self):
@@ -810,34 +1339,59 @@ class DavServer(object):
             return HttpResponseForbidden()
         depth = self.get_depth()
         names_only, props = False, []
-        length = self.request.META.get('CONTENT_LENGTH', 0)
-        if not length or int(length) != 0:
+        length = self.request.get_content_length()
+        if length:
             #Otherwise, empty prop list is treated as request for ALL props.
-            for ev, el in ElementTree.iterparse(self.request):
-                if el.tag == '{DAV:}allprop':
+            if length > getattr(settings, 'DAV_MAX_PROPFIND_BODY', MAX_PROPFIND_BODY):
+                return HttpResponseRequestEntityTooLarge('Request body too large.')
+            # Request bodies are small, parsing them in one go is cheaper than iterparse().
+            body = self.request.read(length)
+            try:
+                root = ElementTree.fromstring(body) if body else ElementTree.Element(TAG_PROPFIND)
+            except SyntaxError:
+                return HttpResponseBadRequest('Malformed request body.')
+            for el in root.iter():
+                if el.tag == TAG_ALLPROP:
                     if props:
                         return HttpResponseBadRequest()
-                elif el.tag == '{DAV:}propname':
+                elif el.tag == TAG_PROPNAME:
                     names_only = True
-                elif el.tag == '{DAV:}prop':
+                elif el.tag == TAG_PROP:
                     if names_only:
                         return HttpResponseBadRequest()
                     for pr in el:
                         props.append(pr.tag)
-        msr = ElementTree.Element('{DAV:}multistatus')
-        for child in res.get_descendants(depth=depth, include_self=True):
-            response = ElementTree.SubElement(msr, '{DAV:}response')
-            ElementTree.SubElement(response, '{DAV:}href').text = child.get_url()
-            self.props.get_propstat(child, response, *props)
-        response = HttpResponseMultiStatus(ElementTree.tostring(msr, 'UTF-8'), mimetype='application/xml')
+        descendants = res.get_descendants(depth=depth, include_self=True)
+        response = HttpResponseMultiStatus(self.iter_multistatus(descendants, props), mimetype='application/xml')
         response['Date'] = http_date()
+        # The result depends on the request body and on dead properties, neither is covered by
+        # file validators. Make sure caches along the way never answer a PROPFIND themselves.
+        response['Cache-Control'] = 'no-cache, must-revalidate'
         return response
 
+    def iter_multistatus(self, resources, props):
+        '''Yield the multistatus XML document for the given resources. Each response element is
+        serialized and discarded as soon as it is built, the output is collected into chunks of
+        MULTISTATUS_CHUNK_SIZE so the server is not asked to write every small element on its own.
+        Django passes the iterator on to the client as is, so a large (Depth: infinity) PROPFIND
+        is never held in memory as a whole.'''
+        chunk = ['<?xml version="1.0" encoding="utf-8"?>\n<D:multistatus xmlns:D="DAV:">']
+        size = 0
+        for res in resources:
+            data = self.props.get_response_xml(res, *props)
+            chunk.append(data)
+            size += len(data)
+            if size >= MULTISTATUS_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk, size = [], 0
+        chunk.append('</D:multistatus>')
+        yield ''.join(chunk)
+
     def doPROPPATCH(self):
         res = self.get_resource(self.request.path)
         if not res.exists():
             return HttpResponseNotFound()
-        depth = self.get_depth(default=0)
+        depth = self.get_depth(default='0')
         if depth != 0:
             return HttpResponseBadRequest('Invalid depth header value %s' % depth)
         
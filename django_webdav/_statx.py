@@ -0,0 +1,102 @@
+# Copyright (c) 2011, SmartFile <btimby@smartfile.com>
+# All rights reserved.
+#
+# This file is part of django-webdav.
+#
+# Foobar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with django-webdav.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Minimal ctypes binding for the Linux statx() call (glibc 2.28 or newer). statx() is
+called with AT_STATX_DONT_SYNC, which allows network file systems to answer from their
+attribute cache instead of synchronizing with the server first. Use available() to
+check whether it can be used, otherwise fall back to os.stat().'''
+
+import os, sys, ctypes, ctypes.util
+from collections import namedtuple
+
+AT_FDCWD = -100
+AT_STATX_DONT_SYNC = 0x4000
+STATX_BASIC_STATS = 0x7ff
+
+
+class StatxTimestamp(ctypes.Structure):
+    _fields_ = [
+        ('tv_sec', ctypes.c_int64),
+        ('tv_nsec', ctypes.c_uint32),
+        ('reserved', ctypes.c_int32),
+    ]
+
+    def as_float(self):
+        return self.tv_sec + self.tv_nsec / 1e9
+
+
+class Statx(ctypes.Structure):
+    _fields_ = [
+        ('stx_mask', ctypes.c_uint32),
+        ('stx_blksize', ctypes.c_uint32),
+        ('stx_attributes', ctypes.c_uint64),
+        ('stx_nlink', ctypes.c_uint32),
+        ('stx_uid', ctypes.c_uint32),
+        ('stx_gid', ctypes.c_uint32),
+        ('stx_mode', ctypes.c_uint16),
+        ('spare0', ctypes.c_uint16),
+        ('stx_ino', ctypes.c_uint64),
+        ('stx_size', ctypes.c_uint64),
+        ('stx_blocks', ctypes.c_uint64),
+        ('stx_attributes_mask', ctypes.c_uint64),
+        ('stx_atime', StatxTimestamp),
+        ('stx_btime', StatxTimestamp),
+        ('stx_ctime', StatxTimestamp),
+        ('stx_mtime', StatxTimestamp),
+        ('stx_rdev_major', ctypes.c_uint32),
+        ('stx_rdev_minor', ctypes.c_uint32),
+        ('stx_dev_major', ctypes.c_uint32),
+        ('stx_dev_minor', ctypes.c_uint32),
+        # The kernel structure is 256 bytes, the rest is reserved for future fields.
+        ('spare', ctypes.c_uint64 * 14),
+    ]
+
+
+# Carries the subset of os.stat_result attributes the rest of the code uses.
+StatxResult = namedtuple('StatxResult', 'st_mode st_ino st_dev st_nlink st_uid st_gid st_size st_atime st_mtime st_ctime')
+
+_statx = None
+
+def available():
+    '''Return True if statx() can be called on this system. The lookup is only done once.'''
+    global _statx
+    if _statx is None:
+        _statx = False
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+                _statx = libc.statx
+            except (OSError, AttributeError):
+                pass
+            else:
+                _statx.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_uint, ctypes.POINTER(Statx))
+                _statx.restype = ctypes.c_int
+    return bool(_statx)
+
+def statx(path):
+    '''Drop-in replacement for os.stat() (symlinks are followed). Raises OSError on failure,
+    just like os.stat().'''
+    if not isinstance(path, bytes):
+        path = path.encode(sys.getfilesystemencoding())
+    buf = Statx()
+    if _statx(AT_FDCWD, path, AT_STATX_DONT_SYNC, STATX_BASIC_STATS, ctypes.byref(buf)) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), path)
+    return StatxResult(buf.stx_mode, buf.stx_ino, os.makedev(buf.stx_dev_major, buf.stx_dev_minor),
+        buf.stx_nlink, buf.stx_uid, buf.stx_gid, buf.stx_size, buf.stx_atime.as_float(),
+        buf.stx_mtime.as_float(), buf.stx_ctime.as_float())
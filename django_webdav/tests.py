@@ -15,3 +15,785 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with django-webdav.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, errno, shutil, tempfile, threading
+from StringIO import StringIO
+from django.conf import settings
+from django.test.client import RequestFactory
+from django.utils.encoding import smart_unicode
+from django.utils import unittest
+import django_webdav
+from django_webdav import DavServer, DavResource, DavProperty, ElementTree, _statx
+
+
+class ServerTestCase(unittest.TestCase):
+    '''Runs requests against a DavServer exporting a temporary directory.'''
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.factory = RequestFactory()
+        self.settings = {}
+        os.mkdir(os.path.join(self.root, 'dir'))
+        self.write('file.txt', '0123456789')
+        root = self.root
+        class Server(DavServer):
+            def get_root(self):
+                return root
+        self.server_class = Server
+
+    def tearDown(self):
+        for name, value in self.settings.items():
+            if value is None:
+                delattr(settings, name)
+            else:
+                setattr(settings, name, value)
+        DavServer.negative_cache.clear()
+        shutil.rmtree(self.root)
+
+    def set_setting(self, name, value):
+        self.settings.setdefault(name, getattr(settings, name, None))
+        setattr(settings, name, value)
+
+    def write(self, name, data=''):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(data)
+
+    def get_server(self, method, path, body='', **meta):
+        meta.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': '/dav' + path,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': StringIO(body),
+        })
+        return self.server_class(self.factory.request(**meta), path)
+
+    def get_resource(self, path):
+        '''Return a resource as seen by a new request.'''
+        return self.get_server('GET', path).get_resource(path)
+
+    def request(self, method, path, body='', **meta):
+        return self.get_server(method, path, body, **meta).get_response()
+
+
+class ResourceTestCase(ServerTestCase):
+    def test_stat(self):
+        res = self.get_resource('/file.txt')
+        self.assertTrue(res.exists())
+        self.assertTrue(res.isfile())
+        self.assertFalse(res.isdir())
+        self.assertEqual(res.get_size(), 10)
+        self.assertTrue(self.get_resource('/dir').isdir())
+        res = self.get_resource('/missing')
+        self.assertFalse(res.exists() or res.isfile() or res.isdir())
+
+    def test_stat_cached(self):
+        res = self.get_resource('/file.txt')
+        self.assertEqual(res.get_size(), 10)
+        self.write('file.txt', '0123')
+        self.assertEqual(res.get_size(), 10)
+        self.assertEqual(self.get_resource('/file.txt').get_size(), 4)
+
+    def test_stat_reset(self):
+        res = self.get_resource('/new.txt')
+        self.assertFalse(res.exists())
+        f = res.open('wb')
+        f.write('data')
+        f.close()
+        self.assertEqual(res.get_size(), 4)
+        res = self.get_resource('/newdir')
+        self.assertFalse(res.exists())
+        res.mkdir()
+        self.assertTrue(res.isdir())
+
+    def test_children(self):
+        self.write('dir/a.txt', 'a')
+        os.mkdir(os.path.join(self.root, 'dir', 'sub'))
+        children = dict((child.get_name(), child) for child in self.get_resource('/dir').get_children())
+        self.assertEqual(sorted(children), ['a.txt', 'sub'])
+        # Each child comes with its stat result.
+        self.assertTrue(children['a.txt']._stat)
+        self.assertEqual(children['a.txt'].get_size(), 1)
+        self.assertTrue(children['sub'].isdir())
+
+    def test_children_skip_broken_symlink(self):
+        os.symlink(os.path.join(self.root, 'missing'), os.path.join(self.root, 'dir', 'broken'))
+        self.write('dir/a.txt', 'a')
+        names = [child.get_name() for child in self.get_resource('/dir').get_children()]
+        self.assertEqual(names, ['a.txt'])
+
+    def test_etag(self):
+        etag = self.get_resource('/file.txt').get_etag()
+        self.assertEqual(self.get_resource('/file.txt').get_etag(), etag)
+        self.assertNotEqual(self.get_resource('/dir').get_etag(), etag)
+        self.write('file.txt', 'changed')
+        self.assertNotEqual(self.get_resource('/file.txt').get_etag(), etag)
+
+    def test_children_stat_pool(self):
+        self.set_setting('DAV_STAT_PREFETCH_WORKERS', 4)
+        for i in range(100):
+            self.write('dir/%02d.txt' % i, 'x' * i)
+        main = threading.current_thread()
+        threads = set()
+        stat_entry = django_webdav.stat_entry
+        def record(entry):
+            threads.add(threading.current_thread())
+            return stat_entry(entry)
+        django_webdav.stat_entry = record
+        try:
+            children = list(self.get_resource('/dir').get_children())
+        finally:
+            django_webdav.stat_entry = stat_entry
+        self.assertEqual(sorted((child.get_name(), child.get_size()) for child in children),
+                         [('%02d.txt' % i, i) for i in range(100)])
+        self.assertTrue(threads)
+        self.assertFalse(main in threads)
+
+    def test_children_statx(self):
+        self.set_setting('DAV_USE_STATX', True)
+        self.write('dir/a.txt', 'a')
+        paths = []
+        stat_path = django_webdav.stat_path
+        def record(path):
+            paths.append(path)
+            return stat_path(path)
+        django_webdav.stat_path = record
+        try:
+            children = list(self.get_resource('/dir').get_children())
+        finally:
+            django_webdav.stat_path = stat_path
+        self.assertEqual([child.get_size() for child in children], [1])
+        self.assertEqual(paths, [os.path.join(self.root, 'dir', 'a.txt')])
+
+    def test_open_binary(self):
+        res = self.get_resource('/new.txt')
+        with res.open('w') as f:
+            self.assertTrue('b' in f.mode)
+            f.write('a\r\nb\n')
+        with res.open('r') as f:
+            self.assertEqual(f.read(), 'a\r\nb\n')
+
+    def test_move(self):
+        self.write('dir/a.txt', 'a')
+        self.get_resource('/dir').move(self.get_resource('/moved'))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'dir')))
+        self.assertEqual(os.listdir(os.path.join(self.root, 'moved')), ['a.txt'])
+
+    def test_move_cross_device(self):
+        os.mkdir(os.path.join(self.root, 'dir', 'sub'))
+        self.write('dir/sub/a.txt', 'a')
+        path = os.path.join(self.root, 'dir', 'sub', 'a.txt')
+        os.chmod(path, 0600)
+        os.utime(path, (1000000000, 1000000000))
+        def rename(src, dst):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        os_rename = os.rename
+        os.rename = rename
+        try:
+            src, dst = self.get_resource('/dir'), self.get_resource('/moved')
+            src.move(dst)
+        finally:
+            os.rename = os_rename
+        self.assertFalse(src.exists())
+        self.assertTrue(dst.isdir())
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'dir')))
+        st = os.stat(os.path.join(self.root, 'moved', 'sub', 'a.txt'))
+        self.assertEqual(st.st_size, 1)
+        self.assertEqual(st.st_mode & 0777, 0600)
+        self.assertEqual(st.st_mtime, 1000000000)
+
+    def test_path_values(self):
+        res = self.get_resource('/dir/a.txt')
+        self.assertEqual(res.get_name(), 'a.txt')
+        self.assertEqual(res.get_abs_path(), os.path.join(self.root, 'dir', 'a.txt'))
+        self.assertEqual(res.get_url(), 'http://testserver/dav/dir/a.txt')
+        self.assertTrue(res.get_parent() is res.get_parent())
+        self.assertTrue(res.get_parent().isdir())
+
+    def test_child_paths(self):
+        children = dict((child.get_name(), child) for child in self.get_resource('/').get_children())
+        for name, child in children.items():
+            res = self.get_resource('/' + name)
+            self.assertEqual(child.get_path(), res.get_path())
+            self.assertEqual(child.get_abs_path(), res.get_abs_path())
+            self.assertEqual(child.get_url(), res.get_url())
+
+    def test_delete(self):
+        os.mkdir(os.path.join(self.root, 'dir', 'sub'))
+        self.write('dir/sub/a.txt', 'a')
+        res = self.get_resource('/dir')
+        res.delete()
+        self.assertFalse(res.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'dir')))
+        res = self.get_resource('/file.txt')
+        res.delete()
+        self.assertFalse(res.exists())
+
+    def test_delete_symlink(self):
+        self.write('dir/a.txt', 'a')
+        os.symlink(os.path.join(self.root, 'dir'), os.path.join(self.root, 'link'))
+        res = self.get_resource('/link')
+        self.assertTrue(res.isdir())
+        res.delete()
+        self.assertFalse(os.path.lexists(os.path.join(self.root, 'link')))
+        self.assertEqual(os.listdir(os.path.join(self.root, 'dir')), ['a.txt'])
+
+    def test_descendants_breadth_first(self):
+        os.makedirs(os.path.join(self.root, 'dir', 'sub', 'deep'))
+        self.write('dir/sub/deep/a.txt', 'a')
+        paths = [res.get_path() for res in self.get_resource('/').get_descendants(depth=-1)]
+        self.assertEqual(len(paths), 6)
+        levels = [path.count('/') for path in paths]
+        self.assertEqual(levels, sorted(levels))
+        paths = [res.get_path() for res in self.get_resource('/').get_descendants(depth=2, include_self=False)]
+        self.assertEqual(sorted(paths), ['/dir', '/dir/sub', '/file.txt'])
+
+    def test_descendants_lazy(self):
+        for i in range(3):
+            os.mkdir(os.path.join(self.root, 'dir', 'sub%d' % i))
+            for j in range(50):
+                self.write('dir/sub%d/%02d.txt' % (i, j))
+        calls = []
+        stat_entry = django_webdav.stat_entry
+        def record(entry):
+            calls.append(entry)
+            return stat_entry(entry)
+        django_webdav.stat_entry = record
+        try:
+            descendants = self.get_resource('/dir').get_descendants(depth=-1)
+            self.assertEqual(next(descendants).get_name(), 'dir')
+            next(descendants)
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(len(list(descendants)), 152)
+        finally:
+            django_webdav.stat_entry = stat_entry
+
+    def test_etag_format(self):
+        st = os.stat(os.path.join(self.root, 'file.txt'))
+        self.assertEqual(self.get_resource('/file.txt').get_etag(),
+                         '%x-%x-%x' % (st.st_ino, st.st_size, int(st.st_mtime * 1000000)))
+        self.assertEqual(self.get_resource('/missing').get_etag(), None)
+        response = self.request('GET', '/file.txt')
+        self.assertEqual(response['ETag'], '"%s"' % self.get_resource('/file.txt').get_etag())
+
+    def test_base_url(self):
+        request = self.get_server('GET', '/dir').request
+        self.assertEqual(request.get_base(), '/dav')
+        self.assertEqual(request.get_base_url(), 'http://testserver/dav')
+        self.assertTrue(request.get_base_url() is request.get_base_url())
+        self.assertEqual(self.get_server('GET', '').request.get_base(), '/dav')
+
+    def test_delete_known_missing(self):
+        res = self.get_resource('/file.txt')
+        res.delete()
+        calls = []
+        stat_path = django_webdav.stat_path
+        django_webdav.stat_path = lambda path: calls.append(path) or stat_path(path)
+        try:
+            self.assertFalse(res.exists())
+        finally:
+            django_webdav.stat_path = stat_path
+        self.assertEqual(calls, [])
+
+    def test_copy_tree_merge(self):
+        os.mkdir(os.path.join(self.root, 'dir', 'sub'))
+        self.write('dir/a.txt', 'a')
+        self.write('dir/sub/b.txt', 'b')
+        os.makedirs(os.path.join(self.root, 'dst', 'a.txt'))
+        self.write('dst/sub', 'wrong type')
+        self.write('dst/keep.txt', 'keep')
+        self.get_resource('/dir').copy(self.get_resource('/dst'), depth=-1)
+        dst = os.path.join(self.root, 'dst')
+        self.assertEqual(sorted(os.listdir(dst)), ['a.txt', 'keep.txt', 'sub'])
+        self.assertEqual(open(os.path.join(dst, 'a.txt')).read(), 'a')
+        self.assertEqual(open(os.path.join(dst, 'sub', 'b.txt')).read(), 'b')
+        self.assertEqual(open(os.path.join(dst, 'keep.txt')).read(), 'keep')
+
+    def test_stat_shared(self):
+        server = self.get_server('GET', '/file.txt')
+        calls = []
+        stat_path = django_webdav.stat_path
+        django_webdav.stat_path = lambda path: calls.append(path) or stat_path(path)
+        try:
+            self.assertTrue(server.get_resource('/file.txt').exists())
+            self.assertTrue(server.get_resource('/file.txt').exists())
+            self.assertEqual(len(calls), 1)
+            server.get_resource('/file.txt').open('wb').close()
+            self.assertEqual(server.stat_cache, {})
+            self.assertTrue(server.get_resource('/file.txt').exists())
+            self.assertEqual(len(calls), 2)
+        finally:
+            django_webdav.stat_path = stat_path
+
+    @unittest.skipIf(django_webdav.scandir is None, 'scandir() is not available')
+    def test_descendants_close(self):
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.write('dir/' + name)
+        opened = []
+        scandir = django_webdav.scandir
+        class Listing(object):
+            def __init__(self, path):
+                self.entries = iter(list(scandir(path)))
+                self.closed = False
+                opened.append(self)
+            def __iter__(self):
+                return self.entries
+            def close(self):
+                self.closed = True
+        # Keep the listings referenced, so only an explicit close() can release them.
+        listings = []
+        get_children = DavResource.get_children
+        def record(res):
+            listings.append(get_children(res))
+            return listings[-1]
+        django_webdav.scandir = Listing
+        DavResource.get_children = record
+        try:
+            walk = self.get_resource('/dir').get_descendants(depth=-1)
+            next(walk)
+            next(walk)
+            walk.close()
+        finally:
+            django_webdav.scandir = scandir
+            DavResource.get_children = get_children
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+
+    def test_path_split(self):
+        server = self.get_server('GET', '/')
+        for path in ('/dir/sub/a.txt', '/dir/', '/a.txt', '/', '', 'dir/a.txt'):
+            res = server.get_resource(path)
+            stripped = path.rstrip('/')
+            self.assertEqual(res.path, stripped)
+            self.assertEqual(res.get_parent().path, os.path.dirname(stripped).rstrip('/'))
+            self.assertEqual(res.get_name(), os.path.basename(stripped))
+            self.assertEqual(server.get_resource(path).get_name(), os.path.basename(stripped))
+            self.assertEqual(res.get_dirname(), os.path.dirname(res.get_abs_path()))
+
+
+class GetTestCase(ServerTestCase):
+    def test_get(self):
+        response = self.request('GET', '/file.txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(''.join(response), '0123456789')
+
+    def test_get_missing(self):
+        self.assertEqual(self.request('GET', '/missing').status_code, 404)
+        self.assertEqual(self.request('HEAD', '/missing').status_code, 404)
+
+    def test_get_binary(self):
+        self.set_setting('DAV_USE_SENDFILE', False)
+        data = ''.join(chr(i) for i in range(256)) * 5000
+        self.write('file.bin', data)
+        response = self.request('GET', '/file.bin')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(''.join(response), data)
+
+    def test_put(self):
+        data = '\n\x00\r\n' * 400000
+        self.assertEqual(self.request('PUT', '/new.bin', data).status_code, 201)
+        with open(os.path.join(self.root, 'new.bin'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(self.request('PUT', '/new.bin', 'short').status_code, 204)
+        with open(os.path.join(self.root, 'new.bin'), 'rb') as f:
+            self.assertEqual(f.read(), 'short')
+
+    def test_get_headers(self):
+        response = self.request('GET', '/file.txt')
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(response['Content-Length'], '10')
+
+    def test_conditional(self):
+        os.utime(os.path.join(self.root, 'file.txt'), (784111777, 784111777))
+        etag = self.request('GET', '/file.txt')['ETag']
+        self.assertEqual(self.request('GET', '/file.txt', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.request('HEAD', '/file.txt', HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        self.assertEqual(self.request('GET', '/file.txt', HTTP_IF_MATCH=etag).status_code, 200)
+        self.assertEqual(self.request('GET', '/file.txt', HTTP_IF_MATCH='"other"').status_code, 412)
+        since = 'Sun, 06 Nov 1994 08:49:37 GMT'
+        self.assertEqual(self.request('GET', '/file.txt', HTTP_IF_MODIFIED_SINCE=since).status_code, 304)
+        self.assertEqual(self.request('GET', '/file.txt', HTTP_IF_UNMODIFIED_SINCE=since).status_code, 200)
+        earlier = 'Sat, 05 Nov 1994 08:49:37 GMT'
+        self.assertEqual(self.request('GET', '/file.txt', HTTP_IF_MODIFIED_SINCE=earlier).status_code, 200)
+        self.assertEqual(self.request('GET', '/file.txt', HTTP_IF_UNMODIFIED_SINCE=earlier).status_code, 412)
+
+    def test_range(self):
+        response = self.request('GET', '/file.txt', HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(response['Content-Length'], '3')
+        self.assertEqual(''.join(response), '234')
+        response = self.request('GET', '/file.txt')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_range_not_satisfiable(self):
+        response = self.request('GET', '/file.txt', HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_if_range(self):
+        etag = self.request('GET', '/file.txt')['ETag']
+        response = self.request('GET', '/file.txt', HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.request('GET', '/file.txt', HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(''.join(response), '0123456789')
+
+    def test_options(self):
+        response = self.request('OPTIONS', '/file.txt')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertFalse(response.has_header('Allow-Ranges'))
+
+    def test_index(self):
+        self.write('dir/a.txt', 'a')
+        response = self.request('GET', '/dir')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('href="http://testserver/dav/dir/a.txt"' in response.content)
+        template = django_webdav.get_index_template()
+        self.assertTrue(django_webdav.get_index_template() is template)
+
+    def test_not_modified_validators(self):
+        os.utime(os.path.join(self.root, 'file.txt'), (784111777, 784111777))
+        etag = self.request('GET', '/file.txt')['ETag']
+        for method in ('GET', 'HEAD'):
+            response = self.request(method, '/file.txt', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(response['Last-Modified'], 'Sun, 06 Nov 1994 08:49:37 GMT')
+            self.assertTrue(response.has_header('Date'))
+
+
+class NegativeCacheTestCase(ServerTestCase):
+    def setUp(self):
+        super(NegativeCacheTestCase, self).setUp()
+        self.set_setting('DAV_NEGATIVE_CACHE_TTL', 60)
+
+    def test_disabled(self):
+        self.set_setting('DAV_NEGATIVE_CACHE_TTL', 0)
+        self.assertEqual(self.request('GET', '/new.txt').status_code, 404)
+        self.write('new.txt')
+        self.assertEqual(self.request('GET', '/new.txt').status_code, 200)
+
+    def test_external_change(self):
+        self.assertEqual(self.request('GET', '/new.txt').status_code, 404)
+        self.write('new.txt')
+        # Created outside of the server, still known as missing until the entry expires.
+        self.assertEqual(self.request('GET', '/new.txt').status_code, 404)
+        DavServer.negative_cache.clear()
+        self.assertEqual(self.request('GET', '/new.txt').status_code, 200)
+
+    def test_put(self):
+        self.assertEqual(self.request('GET', '/new.txt').status_code, 404)
+        self.assertEqual(self.request('PUT', '/new.txt', 'data').status_code, 201)
+        self.assertEqual(self.request('GET', '/new.txt').status_code, 200)
+
+    def test_write_clears_paths_below(self):
+        self.assertEqual(self.request('GET', '/new/file.txt').status_code, 404)
+        os.mkdir(os.path.join(self.root, 'new'))
+        self.write('new/file.txt')
+        # Any write starts over, entries of other paths (below a renamed or copied directory)
+        # included.
+        self.assertEqual(self.request('MKCOL', '/other').status_code, 201)
+        self.assertEqual(self.request('GET', '/new/file.txt').status_code, 200)
+
+    def test_copy_tree(self):
+        self.write('dir/a.txt', 'a')
+        os.mkdir(os.path.join(self.root, 'dst'))
+        self.assertEqual(self.request('GET', '/dst/a.txt').status_code, 404)
+        self.get_resource('/dir').copy(self.get_resource('/dst'), depth=-1)
+        self.assertEqual(self.request('GET', '/dst/a.txt').status_code, 200)
+
+
+class PropfindTestCase(ServerTestCase):
+    def propfind(self, path, body='', **meta):
+        response = self.request('PROPFIND', path, body, **meta)
+        self.assertEqual(response.status_code, 207)
+        return ElementTree.fromstring(''.join(response))
+
+    def get_hrefs(self, multistatus):
+        return [el.text for el in multistatus.findall('{DAV:}response/{DAV:}href')]
+
+    def test_depth(self):
+        self.write('dir/a.txt', 'a')
+        base = 'http://testserver/dav'
+        self.assertEqual(self.get_hrefs(self.propfind('/dir', HTTP_DEPTH='0')), [base + '/dir'])
+        self.assertEqual(self.get_hrefs(self.propfind('/dir', HTTP_DEPTH='1')), [base + '/dir', base + '/dir/a.txt'])
+        hrefs = self.get_hrefs(self.propfind('/', HTTP_DEPTH='infinity'))
+        self.assertEqual(sorted(hrefs), [base + '/', base + '/dir', base + '/dir/a.txt', base + '/file.txt'])
+
+    def test_file_depth(self):
+        self.assertEqual(len(self.get_hrefs(self.propfind('/file.txt', HTTP_DEPTH='1'))), 1)
+
+    def test_broken_symlink(self):
+        os.symlink(os.path.join(self.root, 'missing'), os.path.join(self.root, 'dir', 'broken'))
+        self.assertEqual(len(self.get_hrefs(self.propfind('/dir', HTTP_DEPTH='1'))), 1)
+
+    def test_unlistable_directory(self):
+        class Resource(DavResource):
+            def get_children(self):
+                if self.get_name() == 'dir':
+                    raise OSError(errno.EACCES, 'Permission denied')
+                for child in super(Resource, self).get_children():
+                    yield child
+        server = self.get_server('PROPFIND', '/')
+        names = [res.get_name() for res in Resource(server, '/').get_descendants(depth=-1)]
+        self.assertEqual(sorted(names), ['', 'dir', 'file.txt'])
+
+    def test_prop(self):
+        body = '<?xml version="1.0"?><D:propfind xmlns:D="DAV:"><D:prop><D:getcontentlength/>' \
+               '<D:missing/></D:prop></D:propfind>'
+        multistatus = self.propfind('/file.txt', body, HTTP_DEPTH='0')
+        propstats = multistatus.findall('{DAV:}response/{DAV:}propstat')
+        self.assertEqual([el.findtext('{DAV:}status') for el in propstats],
+                         ['HTTP/1.1 200 OK', 'HTTP/1.1 404 Not Found'])
+        self.assertEqual(propstats[0].findtext('{DAV:}prop/{DAV:}getcontentlength'), '10')
+        self.assertEqual([el.tag for el in propstats[0].find('{DAV:}prop')], ['{DAV:}getcontentlength'])
+        self.assertEqual([el.tag for el in propstats[1].find('{DAV:}prop')], ['{DAV:}missing'])
+
+    def test_malformed_body(self):
+        response = self.request('PROPFIND', '/file.txt', '<D:propfind xmlns:D="DAV:">', HTTP_DEPTH='0')
+        self.assertEqual(response.status_code, 400)
+
+    def test_depth_default(self):
+        self.write('dir/a.txt', 'a')
+        self.assertEqual(len(self.get_hrefs(self.propfind('/'))), 4)
+        self.assertEqual(self.request('PROPFIND', '/', HTTP_DEPTH='2').status_code, 400)
+
+    def test_chunks(self):
+        for i in range(500):
+            self.write('dir/%03d.txt' % i)
+        chunks = list(self.request('PROPFIND', '/dir', HTTP_DEPTH='1'))
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(chunk) >= django_webdav.MULTISTATUS_CHUNK_SIZE for chunk in chunks[:-1]))
+        self.assertEqual(len(self.get_hrefs(ElementTree.fromstring(''.join(chunks)))), 501)
+
+    def test_allprop(self):
+        os.utime(os.path.join(self.root, 'file.txt'), (784111777, 784111777))
+        multistatus = self.propfind('/', HTTP_DEPTH='1')
+        props = {}
+        for response in multistatus.findall('{DAV:}response'):
+            name = response.findtext('{DAV:}href').rsplit('/', 1)[-1]
+            props[name] = response.find('{DAV:}propstat')
+        self.assertEqual(props['file.txt'].findtext('.//{DAV:}getcontentlength'), '10')
+        self.assertEqual(props['file.txt'].findtext('.//{DAV:}getlastmodified'), 'Sun, 06 Nov 1994 08:49:37 GMT')
+        self.assertEqual(props['file.txt'].findtext('.//{DAV:}displayname'), 'file.txt')
+        self.assertEqual(props['file.txt'].findtext('.//{DAV:}getetag'),
+                         '"%s"' % self.get_resource('/file.txt').get_etag())
+        self.assertEqual(props['file.txt'].find('.//{DAV:}resourcetype').find('{DAV:}collection'), None)
+        self.assertNotEqual(props['dir'].find('.//{DAV:}resourcetype').find('{DAV:}collection'), None)
+
+    def test_fast_path(self):
+        self.write(u'a & \xe9.txt'.encode('utf-8'), 'data')
+        def normalize(el):
+            return el.tag, (el.text or '').strip(), [normalize(child) for child in el]
+        server = self.get_server('PROPFIND', '/')
+        props = server.props
+        for res in self.get_resource('/').get_descendants(depth=1):
+            fast = props.get_response_xml(res)
+            tree = ElementTree.Element('{DAV:}response')
+            ElementTree.SubElement(tree, '{DAV:}href').text = smart_unicode(res.get_url())
+            props.get_propstat(res, tree)
+            self.assertEqual(normalize(ElementTree.fromstring(fast)), normalize(tree))
+        # A dead (or unknown) property takes the tree path.
+        res = self.get_resource('/file.txt')
+        xml = props.get_response_xml(res, '{DAV:}getcontentlength', '{urn:x}other')
+        statuses = [el.text for el in ElementTree.fromstring(xml).iter('{DAV:}status')]
+        self.assertEqual(statuses, ['HTTP/1.1 200 OK', 'HTTP/1.1 404 Not Found'])
+
+    def test_prop_value(self):
+        props = self.get_server('PROPFIND', '/').props
+        self.assertEqual(props.get_prop_value(self.get_resource('/file.txt'), '{DAV:}getcontentlength'), '10')
+        self.assertEqual(props.get_prop_value(self.get_resource('/missing'), '{DAV:}getcontentlength'), None)
+        self.assertEqual(props.get_prop_value(self.get_resource('/file.txt'), '{DAV:}unknown'), None)
+
+    def test_body_too_large(self):
+        body = '<?xml version="1.0"?><D:propfind xmlns:D="DAV:"><D:allprop/></D:propfind>'
+        self.assertEqual(self.request('PROPFIND', '/', body, HTTP_DEPTH='0').status_code, 207)
+        self.set_setting('DAV_MAX_PROPFIND_BODY', 16)
+        self.assertEqual(self.request('PROPFIND', '/', body, HTTP_DEPTH='0').status_code, 413)
+
+    def test_cache_control(self):
+        for path in ('/dir', '/file.txt'):
+            response = self.request('PROPFIND', path, HTTP_DEPTH='1')
+            self.assertEqual(response.status_code, 207)
+            self.assertEqual(response['Cache-Control'], 'no-cache, must-revalidate')
+
+
+class MethodsTestCase(ServerTestCase):
+    def setUp(self):
+        super(MethodsTestCase, self).setUp()
+        store = self.store = {}
+        class Props(DavProperty):
+            def get_dead_names(self, res):
+                return [name for path, name in store if path == res.get_path()]
+            def get_dead_value(self, res, name):
+                return store.get((res.get_path(), name))
+            def set_dead_value(self, res, name, value):
+                store[res.get_path(), name] = value
+            def del_dead_prop(self, res, name):
+                store.pop((res.get_path(), name), None)
+        class Server(self.server_class):
+            def __init__(self, request, path):
+                super(Server, self).__init__(request, path, property_class=Props)
+        self.server_class = Server
+
+    def test_delete(self):
+        self.store['/file.txt', '{urn:x}color'] = 'red'
+        self.assertEqual(self.request('DELETE', '/file.txt').status_code, 204)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'file.txt')))
+        self.assertEqual(self.store, {})
+        self.assertEqual(self.request('DELETE', '/file.txt').status_code, 404)
+
+    def test_move(self):
+        self.store['/file.txt', '{urn:x}color'] = 'red'
+        response = self.request('MOVE', '/file.txt', HTTP_DESTINATION='http://testserver/dav/dir/moved.txt')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'file.txt')))
+        self.assertEqual(self.request('GET', '/dir/moved.txt').status_code, 200)
+        self.assertEqual(self.store, {('/dir/moved.txt', '{urn:x}color'): 'red'})
+
+    def test_copy(self):
+        self.store['/file.txt', '{urn:x}color'] = 'red'
+        response = self.request('COPY', '/file.txt', HTTP_DESTINATION='http://testserver/dav/copy.txt')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(''.join(self.request('GET', '/copy.txt')), '0123456789')
+        self.assertEqual(self.store['/copy.txt', '{urn:x}color'], 'red')
+        self.assertEqual(self.store['/file.txt', '{urn:x}color'], 'red')
+        response = self.request('COPY', '/file.txt', HTTP_DESTINATION='http://testserver/dav/copy.txt',
+                                HTTP_OVERWRITE='F')
+        self.assertEqual(response.status_code, 412)
+
+    def test_copy_collection(self):
+        self.set_setting('DAV_NEGATIVE_CACHE_TTL', 60)
+        self.write('dir/a.txt', 'a')
+        os.mkdir(os.path.join(self.root, 'dst'))
+        self.assertEqual(self.request('GET', '/dst/a.txt').status_code, 404)
+        response = self.request('COPY', '/dir', HTTP_DESTINATION='http://testserver/dav/dst')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(''.join(self.request('GET', '/dst/a.txt')), 'a')
+
+    def test_move_negative_cache(self):
+        self.set_setting('DAV_NEGATIVE_CACHE_TTL', 60)
+        self.write('dir/inner.txt', 'inner')
+        self.assertEqual(self.request('GET', '/dst/inner.txt').status_code, 404)
+        response = self.request('MOVE', '/dir', HTTP_DESTINATION='http://testserver/dav/dst')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.request('GET', '/dst/inner.txt').status_code, 200)
+
+    def test_options(self):
+        self.assertEqual(self.request('OPTIONS', '/dir')['Allow'], django_webdav.ALLOW_COLLECTION)
+        self.assertEqual(self.request('OPTIONS', '/file.txt')['Allow'], django_webdav.ALLOW_RESOURCE)
+        self.assertEqual(self.request('OPTIONS', '/new.txt')['Allow'], django_webdav.ALLOW_MISSING)
+        response = self.request('OPTIONS', '')
+        self.assertEqual(response['DAV'], '1,2')
+        self.assertFalse(response.has_header('Allow'))
+
+    def test_unknown_method(self):
+        response = self.request('BREW', '/file.txt')
+        self.assertEqual(response.status_code, 405)
+        self.assertTrue('PROPFIND' in response['Allow'].split(', '))
+        self.assertFalse('BREW' in response['Allow'].split(', '))
+
+    def test_subclass_method(self):
+        class Server(self.server_class):
+            def doREPORT(self):
+                return django_webdav.HttpResponse('report')
+        self.server_class = Server
+        self.assertEqual(self.request('REPORT', '/file.txt').content, 'report')
+        self.assertTrue('REPORT' in self.request('BREW', '/file.txt')['Allow'].split(', '))
+
+
+@unittest.skipUnless(_statx.available(), 'statx() is not available')
+class StatxTestCase(ServerTestCase):
+    def test_statx(self):
+        for name in ('file.txt', 'dir'):
+            path = os.path.join(self.root, name)
+            st, expected = _statx.statx(path), os.stat(path)
+            self.assertEqual(st.st_mode, expected.st_mode)
+            self.assertEqual(st.st_ino, expected.st_ino)
+            self.assertEqual(st.st_size, expected.st_size)
+            self.assertAlmostEqual(st.st_mtime, expected.st_mtime, places=3)
+
+    def test_statx_missing(self):
+        try:
+            _statx.statx(os.path.join(self.root, 'missing'))
+        except OSError, e:
+            self.assertEqual(e.errno, errno.ENOENT)
+        else:
+            self.fail('statx() did not raise OSError')
+
+
+class UtilityTestCase(unittest.TestCase):
+    def test_safe_join(self):
+        self.assertEqual(django_webdav.safe_join('/root', 'a', 'b'), '/root/a/b')
+        self.assertEqual(django_webdav.safe_join('root/', '/a/', '//b'), '/root/a/b')
+        self.assertEqual(django_webdav.safe_join('/root', 'a', ''), '/root/a/')
+        self.assertEqual(django_webdav.safe_join('/', '/'), '/')
+
+    def test_guess_content_type(self):
+        self.assertEqual(django_webdav.guess_content_type('a.txt'), 'text/plain')
+        self.assertEqual(django_webdav.guess_content_type('A.TXT'), 'text/plain')
+        self.assertEqual(django_webdav.CONTENT_TYPES['.txt'], 'text/plain')
+        self.assertEqual(django_webdav.guess_content_type('noext'), 'application/octet-stream')
+        self.assertEqual(django_webdav.guess_content_type('a.unknown-ext'), 'application/octet-stream')
+
+    def test_parse_time(self):
+        for value in ('Sun, 06 Nov 1994 08:49:37 GMT', 'Sunday, 06-Nov-94 08:49:37 GMT',
+                      'Sun Nov  6 08:49:37 1994', 'Sun, 06 Nov 1994 09:49:37 +0100'):
+            self.assertEqual(django_webdav.parse_time(value), 784111777)
+        self.assertEqual(django_webdav.parse_time('garbage'), None)
+
+    def test_ns_join(self):
+        self.assertEqual(django_webdav.ns_join('DAV:', 'getetag'), '{DAV:}getetag')
+        self.assertEqual(django_webdav.ns_join('urn:x', 'y'), '{urn:x}y')
+
+    def test_rfc3339_date(self):
+        self.assertEqual(django_webdav.rfc3339_date(784111777), '1994-11-06T08:49:37Z')
+        self.assertEqual(django_webdav.rfc3339_date(0), '')
+
+    def test_safe_join_traversal(self):
+        self.assertEqual(django_webdav.safe_join('/root', '../etc/passwd'), '/root/etc/passwd')
+        self.assertEqual(django_webdav.safe_join('/root', 'a/../../..', 'b'), '/root/b')
+        self.assertEqual(django_webdav.safe_join('/root', 'a/./b//c/'), '/root/a/b/c/')
+        self.assertEqual(django_webdav.safe_join('/root', '..'), '/root/')
+
+    def test_http_date_cached(self):
+        self.assertEqual(django_webdav.http_date_cached(784111777.5), 'Sun, 06 Nov 1994 08:49:37 GMT')
+        self.assertEqual(django_webdav.HTTP_DATES[784111777], 'Sun, 06 Nov 1994 08:49:37 GMT')
+        self.assertEqual(django_webdav.rfc3339_date(784111777.5), '1994-11-06T08:49:37Z')
+        self.assertEqual(django_webdav.RFC3339_DATES[784111777], '1994-11-06T08:49:37Z')
+
+    def test_parse_range(self):
+        parse_range = django_webdav.parse_range
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-200', 100), (0, 99))
+        # Not satisfiable.
+        self.assertEqual(parse_range('bytes=100-', 100), False)
+        self.assertEqual(parse_range('bytes=-0', 100), False)
+        self.assertEqual(parse_range('bytes=-10', 0), False)
+        # Ignored, the whole resource is sent.
+        self.assertEqual(parse_range('bytes=0-1,5-6', 100), None)
+        self.assertEqual(parse_range('bytes=9-0', 100), None)
+        self.assertEqual(parse_range('bytes=-', 100), None)
+        self.assertEqual(parse_range('items=0-9', 100), None)
+
+    def test_slots(self):
+        acl = django_webdav.DavAcl(write=False)
+        self.assertFalse(hasattr(acl, '__dict__'))
+        self.assertTrue(acl.read and not acl.write)
+
+    def test_url_join(self):
+        self.assertEqual(django_webdav.url_join('http://host/dav//', 'a', 'b'), 'http://host/dav/a/b')
+        self.assertEqual(django_webdav.url_join('http://host', ''), 'http://host/')
+
+    def test_ns_split(self):
+        self.assertEqual(django_webdav.ns_split('{DAV:}getetag'), ('DAV:', 'getetag'))
+        self.assertEqual(django_webdav.ns_split('{http://example.com/ns}color'), ('http://example.com/ns', 'color'))
+        self.assertEqual(django_webdav.ns_split('color'), ('', 'color'))
+        self.assertEqual(django_webdav.ns_split('{broken'), ('', '{broken'))
+
+    def test_content_types_prefilled(self):
+        self.assertEqual(django_webdav.CONTENT_TYPES['.png'], 'image/png')
+        self.assertEqual(django_webdav.guess_content_type('IMAGE.PNG'), 'image/png')
+        self.assertTrue(len(django_webdav.CONTENT_TYPES) <= django_webdav.CONTENT_TYPES_MAX)